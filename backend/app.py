@@ -1,23 +1,78 @@
 """
 Flask application for accounting system backend
 """
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, send_from_directory, stream_with_context
 from flask_cors import CORS
+from flask_compress import Compress
 from models import *
 from services import AccountingService, VoucherService, ReportService
+from json_response import ORJSONProvider, ndjson_line, orjson_response
+from cache import cached, invalidate
+from sqlalchemy import event, text
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
 import json
 import os
+import time
 
 app = Flask(__name__, static_folder='../.')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///accounting.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///accounting.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,
+    'connect_args': {'check_same_thread': False}
+}
+
+# Use orjson for Flask's own JSON handling (request.json, error pages)
+app.json = ORJSONProvider(app)
 
 # Initialize database
 db.init_app(app)
 
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection: WAL journal, no fsync per commit, in-memory temp/cache"""
+    # Let SQLAlchemy emit BEGIN (see begin_sqlite_transaction); pysqlite would delay
+    # it to the first INSERT/UPDATE, leaving the reads before it outside the transaction
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-65536')
+    cursor.close()
+
+def begin_sqlite_transaction(conn):
+    """Open every transaction explicitly; write_transaction() asks for BEGIN IMMEDIATE"""
+    conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
+    event.listen(db.engine, 'begin', begin_sqlite_transaction)
+
+@contextmanager
+def write_transaction():
+    """db.session.begin() that takes SQLite's writer lock before the first read
+
+    Vouchers read stock batches and sequence blocks and then write based on
+    them; with BEGIN IMMEDIATE no other writer can commit in between.
+    Concurrent writers wait for the lock (busy timeout) instead.
+    """
+    with db.session.begin():
+        db.session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+        yield
+
 # Enable CORS - Allow all origins for development
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+# Compress JSON/NDJSON responses; their repeated keys compress very well
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'application/x-ndjson']
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'deflate']
+app.config['COMPRESS_LEVEL'] = 6
+Compress(app)
+
 # ============= STATIC FILE SERVING =============
 
 @app.route('/')
@@ -27,103 +82,134 @@ def serve_frontend():
 
 # ============= CONFIG API =============
 
+# The config row is effectively static; cache its values instead of querying per request.
+# Plain values are cached (not the ORM instance) so they outlive the request's session.
+_config_cache = {'v': None, 'ts': 0}
+
+def get_config_cached(ttl=30):
+    """Get system configuration as a dict, re-read from the database at most every ttl seconds"""
+    now = time.time()
+    if _config_cache['v'] is None or now - _config_cache['ts'] > ttl:
+        config = Config.query.first()
+        _config_cache['v'] = {
+            'functionalCurrency': config.functional_currency,
+            'vatRate': config.vat_rate,
+            'costing': config.costing
+        } if config else None
+        _config_cache['ts'] = now
+    return _config_cache['v']
+
 @app.route('/api/config', methods=['GET'])
+@cached('master', ttl=60)
 def get_config():
     """Get system configuration"""
-    config = Config.query.first()
+    config = get_config_cached()
     if not config:
-        return jsonify({'error': 'Config not found'}), 404
+        return orjson_response({'error': 'Config not found'}, 404)
 
-    return jsonify({
-        'functionalCurrency': config.functional_currency,
-        'vatRate': config.vat_rate,
-        'costing': config.costing
-    })
+    return orjson_response(config)
 
 # ============= MASTER DATA APIs =============
 
+# Column-level selects built once at import: rows come back as plain tuples,
+# skipping ORM instance construction and identity-map bookkeeping
+BRANCHES_SELECT = db.select(Branch.id, Branch.name)
+COST_CENTERS_SELECT = db.select(CostCenter.id, CostCenter.name)
+CURRENCIES_SELECT = db.select(Currency.code, Currency.name, Currency.functional)
+ITEMS_SELECT = db.select(Item.sku, Item.name, Item.uom, Item.cat4, Item.cat5)
+PRICES_SELECT = db.select(Price.sku, Price.price)
+ITEM_MAPPING_SELECT = db.select(
+    ItemGLMapping.category, ItemGLMapping.inv_account, ItemGLMapping.sales_account, ItemGLMapping.cogs_account
+)
+COA_SELECT = db.select(ChartOfAccount.code, ChartOfAccount.name, ChartOfAccount.side)
+TAX_CODES_SELECT = db.select(TaxCode.code, TaxCode.type, TaxCode.rate, TaxCode.gl, TaxCode.gl_out, TaxCode.gl_in)
+
 @app.route('/api/branches', methods=['GET'])
+@cached('master', ttl=60)
 def get_branches():
     """Get all branches"""
-    branches = Branch.query.all()
-    return jsonify([{'id': b.id, 'name': b.name} for b in branches])
+    rows = db.session.execute(BRANCHES_SELECT)
+    return orjson_response([{'id': id_, 'name': name} for id_, name in rows])
 
 @app.route('/api/cost-centers', methods=['GET'])
+@cached('master', ttl=60)
 def get_cost_centers():
     """Get all cost centers"""
-    centers = CostCenter.query.all()
-    return jsonify([{'id': c.id, 'name': c.name} for c in centers])
+    rows = db.session.execute(COST_CENTERS_SELECT)
+    return orjson_response([{'id': id_, 'name': name} for id_, name in rows])
 
 @app.route('/api/currencies', methods=['GET'])
+@cached('master', ttl=60)
 def get_currencies():
     """Get all currencies"""
-    currencies = Currency.query.all()
-    return jsonify([{'code': c.code, 'name': c.name, 'functional': c.functional} for c in currencies])
+    rows = db.session.execute(CURRENCIES_SELECT)
+    return orjson_response([{'code': code, 'name': name, 'functional': functional} for code, name, functional in rows])
 
 @app.route('/api/items', methods=['GET'])
+@cached('master', ttl=60)
 def get_items():
     """Get all items"""
-    items = Item.query.all()
-    return jsonify([{
-        'sku': i.sku,
-        'name': i.name,
-        'uom': i.uom,
-        'cat4': i.cat4,
-        'cat5': i.cat5
-    } for i in items])
+    rows = db.session.execute(ITEMS_SELECT)
+    return orjson_response([{
+        'sku': sku,
+        'name': name,
+        'uom': uom,
+        'cat4': cat4,
+        'cat5': cat5
+    } for sku, name, uom, cat4, cat5 in rows])
 
 @app.route('/api/prices', methods=['GET'])
+@cached('master', ttl=60)
 def get_prices():
     """Get all prices as a dictionary"""
-    prices = Price.query.all()
-    return jsonify({p.sku: p.price for p in prices})
+    prices = dict(db.session.execute(PRICES_SELECT).all())
+    return orjson_response(prices)
 
 @app.route('/api/item-mapping', methods=['GET'])
+@cached('master', ttl=60)
 def get_item_mapping():
     """Get item GL mappings"""
-    mappings = ItemGLMapping.query.all()
-    result = {}
-    for m in mappings:
-        result[m.category] = {
-            'inv': m.inv_account,
-            'sales': m.sales_account,
-            'cogs': m.cogs_account
-        }
-    return jsonify(result)
+    rows = db.session.execute(ITEM_MAPPING_SELECT)
+    return orjson_response({
+        category: {'inv': inv, 'sales': sales, 'cogs': cogs}
+        for category, inv, sales, cogs in rows
+    })
 
 @app.route('/api/coa', methods=['GET'])
+@cached('master', ttl=60)
 def get_coa():
     """Get chart of accounts"""
-    accounts = ChartOfAccount.query.all()
-    return jsonify([{
-        'code': a.code,
-        'name': a.name,
-        'side': a.side
-    } for a in accounts])
+    rows = db.session.execute(COA_SELECT)
+    return orjson_response([{
+        'code': code,
+        'name': name,
+        'side': side
+    } for code, name, side in rows])
 
 @app.route('/api/tax-codes', methods=['GET'])
+@cached('master', ttl=60)
 def get_tax_codes():
     """Get tax codes"""
-    taxes = TaxCode.query.all()
     result = []
-    for t in taxes:
+    for code, type_, rate, gl, gl_out, gl_in in db.session.execute(TAX_CODES_SELECT):
         tax_dict = {
-            'code': t.code,
-            'type': t.type,
-            'rate': t.rate
+            'code': code,
+            'type': type_,
+            'rate': rate
         }
-        if t.gl:
-            tax_dict['gl'] = t.gl
-        if t.gl_out:
-            tax_dict['glOut'] = t.gl_out
-        if t.gl_in:
-            tax_dict['glIn'] = t.gl_in
+        if gl:
+            tax_dict['gl'] = gl
+        if gl_out:
+            tax_dict['glOut'] = gl_out
+        if gl_in:
+            tax_dict['glIn'] = gl_in
         result.append(tax_dict)
-    return jsonify(result)
+    return orjson_response(result)
 
 # ============= JOURNAL ENTRIES API =============
 
 @app.route('/api/journal', methods=['GET'])
+@cached('journal', ttl=5)
 def get_journal():
     """Get journal entries with optional filters"""
     from_date = request.args.get('from')
@@ -131,10 +217,17 @@ def get_journal():
     branch = request.args.get('branch')
     cc = request.args.get('cc')
     limit = int(request.args.get('limit', 100))
+    # Keyset paging: pass cursor (empty for the first page) to get {entries, nextCursor}
+    cursor = request.args.get('cursor')
+
+    try:
+        after = ReportService.parse_journal_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return orjson_response({'error': str(e)}, 400)
 
-    entries = ReportService.get_journal(from_date, to_date, branch, cc, limit)
+    entries = ReportService.get_journal(from_date, to_date, branch, cc, limit, after)
 
-    return jsonify([{
+    result = [{
         'docDate': e.doc_date,
         'docNo': e.doc_no,
         'acc': e.acc,
@@ -142,7 +235,14 @@ def get_journal():
         'credit': e.credit,
         'branch': e.branch,
         'cc': e.cc
-    } for e in entries])
+    } for e in entries]
+
+    if cursor is None:
+        return orjson_response(result)
+
+    # A full page may have more after it; an empty or short one is the last
+    next_cursor = ReportService.journal_cursor(entries[-1]) if entries and len(entries) == limit else None
+    return orjson_response({'entries': result, 'nextCursor': next_cursor})
 
 # ============= DOCUMENTS API =============
 
@@ -150,11 +250,11 @@ def get_journal():
 def get_documents():
     """Get all documents"""
     limit = int(request.args.get('limit', 50))
-    docs = Document.query.order_by(Document.created_at.desc()).limit(limit).all()
+    # Load all lines for the page in one extra query instead of one per document
+    docs = Document.query.options(db.selectinload(Document.lines)).order_by(Document.created_at.desc()).limit(limit).all()
 
     result = []
     for doc in docs:
-        lines = DocumentLine.query.filter_by(doc_no=doc.no).all()
         result.append({
             'no': doc.no,
             'type': doc.type,
@@ -172,60 +272,77 @@ def get_documents():
                 'qty': l.qty,
                 'price': l.price,
                 'net': l.net
-            } for l in lines]
+            } for l in doc.lines]
         })
 
-    return jsonify(result)
+    return orjson_response(result)
 
 # ============= VOUCHER POSTING APIs =============
 
+def get_item_name(sku, ttl=60):
+    """Get an item's name for document line descriptions ('' if unknown)
+
+    Cached per process; entries are keyed on a ttl-second time window, so items
+    changed by another process (e.g. seed_data) are picked up within ttl.
+    """
+    return _get_item_name(sku, int(time.time() // ttl))
+
+@lru_cache(maxsize=4096)
+def _get_item_name(sku, window):
+    """Item name lookup behind get_item_name; window only partitions the cache"""
+    name = db.session.execute(db.select(Item.name).filter_by(sku=sku)).scalar()
+    return name or ''
+
 @app.route('/api/vouchers/sale', methods=['POST'])
 def post_sale():
     """Post a sales invoice"""
     try:
         data = request.json
-        config = Config.query.first()
 
-        result = VoucherService.post_sale(
-            date=data['date'],
-            branch=data['branch'],
-            cc=data['cc'],
-            sku=data['sku'],
-            qty=data['qty'],
-            price=data['price'],
-            cash_or_ar=data['cashOrAR'],
-            currency=data.get('currency', 'SAR'),
-            vat_rate=config.vat_rate
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='فاتورة مبيعات',
-            date=data['date'],
-            branch=data['branch'],
-            cc=data['cc'],
-            currency=data.get('currency', 'SAR'),
-            base=result['base'],
-            vat=result['vat'],
-            total=result['total']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            sku=data['sku'],
-            desc=result['item_name'],
-            qty=data['qty'],
-            price=data['price'],
-            net=result['base']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            config = get_config_cached()
+
+            result = VoucherService.post_sale(
+                date=data['date'],
+                branch=data['branch'],
+                cc=data['cc'],
+                sku=data['sku'],
+                qty=data['qty'],
+                price=data['price'],
+                cash_or_ar=data['cashOrAR'],
+                currency=data.get('currency', 'SAR'),
+                vat_rate=config['vatRate']
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='فاتورة مبيعات',
+                date=data['date'],
+                branch=data['branch'],
+                cc=data['cc'],
+                currency=data.get('currency', 'SAR'),
+                base=result['base'],
+                vat=result['vat'],
+                total=result['total']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                sku=data['sku'],
+                desc=result['item_name'],
+                qty=data['qty'],
+                price=data['price'],
+                net=result['base']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'cogs': result['cogs'],
@@ -234,55 +351,58 @@ def post_sale():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/purchase', methods=['POST'])
 def post_purchase():
     """Post a purchase invoice"""
     try:
         data = request.json
-        config = Config.query.first()
 
-        result = VoucherService.post_purchase(
-            date=data['date'],
-            branch=data['branch'],
-            cc=data['cc'],
-            sku=data['sku'],
-            qty=data['qty'],
-            price=data['price'],
-            payment_type=data['paymentType'],
-            supplier_acc=data.get('supplierAcc'),
-            vat_rate=config.vat_rate
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='فاتورة مشتريات',
-            date=data['date'],
-            branch=data['branch'],
-            cc=data['cc'],
-            currency='SAR',
-            base=result['base'],
-            vat=result['vat'],
-            total=result['total']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            sku=data['sku'],
-            desc=result['item_name'],
-            qty=data['qty'],
-            price=data['price'],
-            net=result['base']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            config = get_config_cached()
+
+            result = VoucherService.post_purchase(
+                date=data['date'],
+                branch=data['branch'],
+                cc=data['cc'],
+                sku=data['sku'],
+                qty=data['qty'],
+                price=data['price'],
+                payment_type=data['paymentType'],
+                supplier_acc=data.get('supplierAcc'),
+                vat_rate=config['vatRate']
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='فاتورة مشتريات',
+                date=data['date'],
+                branch=data['branch'],
+                cc=data['cc'],
+                currency='SAR',
+                base=result['base'],
+                vat=result['vat'],
+                total=result['total']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                sku=data['sku'],
+                desc=result['item_name'],
+                qty=data['qty'],
+                price=data['price'],
+                net=result['base']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل وإضافة دفعة FIFO'
@@ -290,7 +410,7 @@ def post_purchase():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/receipt', methods=['POST'])
 def post_receipt():
@@ -298,38 +418,40 @@ def post_receipt():
     try:
         data = request.json
 
-        result = VoucherService.post_receipt(
-            date=data['date'],
-            from_acc=data['fromAcc'],
-            to_acc=data['toAcc'],
-            amount=data['amount'],
-            branch=data.get('branch', ''),
-            cc=data.get('cc', '')
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='سند قبض',
-            date=data['date'],
-            base=result['amount'],
-            vat=0,
-            total=result['amount']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            acc=data['toAcc'],
-            desc='تحصيل نقدي/بنكي',
-            net=result['amount']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            result = VoucherService.post_receipt(
+                date=data['date'],
+                from_acc=data['fromAcc'],
+                to_acc=data['toAcc'],
+                amount=data['amount'],
+                branch=data.get('branch', ''),
+                cc=data.get('cc', '')
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='سند قبض',
+                date=data['date'],
+                base=result['amount'],
+                vat=0,
+                total=result['amount']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                acc=data['toAcc'],
+                desc='تحصيل نقدي/بنكي',
+                net=result['amount']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل'
@@ -337,7 +459,7 @@ def post_receipt():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/payment', methods=['POST'])
 def post_payment():
@@ -345,38 +467,40 @@ def post_payment():
     try:
         data = request.json
 
-        result = VoucherService.post_payment(
-            date=data['date'],
-            from_acc=data['fromAcc'],
-            to_acc=data['toAcc'],
-            amount=data['amount'],
-            branch=data.get('branch', ''),
-            cc=data.get('cc', '')
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='سند صرف',
-            date=data['date'],
-            base=result['amount'],
-            vat=0,
-            total=result['amount']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            acc=data['toAcc'],
-            desc='صرف نقدي/بنكي',
-            net=result['amount']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            result = VoucherService.post_payment(
+                date=data['date'],
+                from_acc=data['fromAcc'],
+                to_acc=data['toAcc'],
+                amount=data['amount'],
+                branch=data.get('branch', ''),
+                cc=data.get('cc', '')
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='سند صرف',
+                date=data['date'],
+                base=result['amount'],
+                vat=0,
+                total=result['amount']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                acc=data['toAcc'],
+                desc='صرف نقدي/بنكي',
+                net=result['amount']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل'
@@ -384,7 +508,7 @@ def post_payment():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/journal', methods=['POST'])
 def post_journal():
@@ -392,45 +516,46 @@ def post_journal():
     try:
         data = request.json
 
-        result = VoucherService.post_journal(
-            date=data['date'],
-            debit_acc=data['debitAcc'],
-            credit_acc=data['creditAcc'],
-            amount=data['amount'],
-            branch=data.get('branch', ''),
-            cc=data.get('cc', '')
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='قيد يومية',
-            date=data['date'],
-            base=result['amount'],
-            vat=0,
-            total=result['amount']
-        )
-        db.session.add(doc)
-
-        # Save document lines
-        line1 = DocumentLine(
-            doc_no=result['doc_no'],
-            acc=data['debitAcc'],
-            desc='',
-            net=result['amount']
-        )
-        line2 = DocumentLine(
-            doc_no=result['doc_no'],
-            acc=data['creditAcc'],
-            desc='',
-            net=-result['amount']
-        )
-        db.session.add(line1)
-        db.session.add(line2)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            result = VoucherService.post_journal(
+                date=data['date'],
+                debit_acc=data['debitAcc'],
+                credit_acc=data['creditAcc'],
+                amount=data['amount'],
+                branch=data.get('branch', ''),
+                cc=data.get('cc', '')
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='قيد يومية',
+                date=data['date'],
+                base=result['amount'],
+                vat=0,
+                total=result['amount']
+            )
+
+            # Save document lines
+            line1 = DocumentLine(
+                doc_no=result['doc_no'],
+                acc=data['debitAcc'],
+                desc='',
+                net=result['amount']
+            )
+            line2 = DocumentLine(
+                doc_no=result['doc_no'],
+                acc=data['creditAcc'],
+                desc='',
+                net=-result['amount']
+            )
+
+            db.session.add_all([doc, line1, line2])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل'
@@ -438,52 +563,54 @@ def post_journal():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/return-sale', methods=['POST'])
 def post_return_sale():
     """Post a sales return"""
     try:
         data = request.json
-        config = Config.query.first()
 
-        result = VoucherService.post_sales_return(
-            date=data['date'],
-            sku=data['sku'],
-            qty=data['qty'],
-            price=data['price'],
-            refund_type=data['refundType'],
-            vat_rate=config.vat_rate,
-            branch=data.get('branch', ''),
-            cc=data.get('cc', '')
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='مرتجع مبيعات',
-            date=data['date'],
-            base=result['base'],
-            vat=result['vat'],
-            total=result['total']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        item = Item.query.filter_by(sku=data['sku']).first()
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            sku=data['sku'],
-            desc=item.name if item else '',
-            qty=data['qty'],
-            price=data['price'],
-            net=result['base']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            config = get_config_cached()
+
+            result = VoucherService.post_sales_return(
+                date=data['date'],
+                sku=data['sku'],
+                qty=data['qty'],
+                price=data['price'],
+                refund_type=data['refundType'],
+                vat_rate=config['vatRate'],
+                branch=data.get('branch', ''),
+                cc=data.get('cc', '')
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='مرتجع مبيعات',
+                date=data['date'],
+                base=result['base'],
+                vat=result['vat'],
+                total=result['total']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                sku=data['sku'],
+                desc=get_item_name(data['sku']),
+                qty=data['qty'],
+                price=data['price'],
+                net=result['base']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل'
@@ -491,52 +618,54 @@ def post_return_sale():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/vouchers/return-purchase', methods=['POST'])
 def post_return_purchase():
     """Post a purchase return"""
     try:
         data = request.json
-        config = Config.query.first()
 
-        result = VoucherService.post_purchase_return(
-            date=data['date'],
-            sku=data['sku'],
-            qty=data['qty'],
-            price=data['price'],
-            supplier_acc=data.get('supplierAcc'),
-            vat_rate=config.vat_rate,
-            branch=data.get('branch', ''),
-            cc=data.get('cc', '')
-        )
-
-        # Save document
-        doc = Document(
-            no=result['doc_no'],
-            type='مرتجع مشتريات',
-            date=data['date'],
-            base=result['base'],
-            vat=result['vat'],
-            total=result['total']
-        )
-        db.session.add(doc)
-
-        # Save document line
-        item = Item.query.filter_by(sku=data['sku']).first()
-        line = DocumentLine(
-            doc_no=result['doc_no'],
-            sku=data['sku'],
-            desc=item.name if item else '',
-            qty=data['qty'],
-            price=data['price'],
-            net=result['base']
-        )
-        db.session.add(line)
-
-        db.session.commit()
-
-        return jsonify({
+        # One transaction for the whole voucher: a single COMMIT, or a rollback on any error
+        with write_transaction(), db.session.no_autoflush:
+            config = get_config_cached()
+
+            result = VoucherService.post_purchase_return(
+                date=data['date'],
+                sku=data['sku'],
+                qty=data['qty'],
+                price=data['price'],
+                supplier_acc=data.get('supplierAcc'),
+                vat_rate=config['vatRate'],
+                branch=data.get('branch', ''),
+                cc=data.get('cc', '')
+            )
+
+            # Save document
+            doc = Document(
+                no=result['doc_no'],
+                type='مرتجع مشتريات',
+                date=data['date'],
+                base=result['base'],
+                vat=result['vat'],
+                total=result['total']
+            )
+
+            # Save document line
+            line = DocumentLine(
+                doc_no=result['doc_no'],
+                sku=data['sku'],
+                desc=get_item_name(data['sku']),
+                qty=data['qty'],
+                price=data['price'],
+                net=result['base']
+            )
+
+            db.session.add_all([doc, line])
+
+        invalidate('journal')
+
+        return orjson_response({
             'success': True,
             'doc_no': result['doc_no'],
             'message': 'تم الترحيل'
@@ -544,7 +673,7 @@ def post_return_purchase():
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 # ============= REPORTS APIs =============
 
@@ -561,79 +690,91 @@ def report_ledger():
     to_date = request.args.get('to')
 
     if not account:
-        return jsonify({'error': 'Account code required'}), 400
+        return orjson_response({'error': 'Account code required'}, 400)
 
     ledger = ReportService.get_ledger(account, from_date, to_date)
-    return jsonify(ledger)
+    return orjson_response(ledger)
 
 @app.route('/api/reports/trial-balance', methods=['GET'])
+@cached('journal', ttl=300)
 def report_trial_balance():
     """Trial balance report"""
     tb = ReportService.get_trial_balance()
-    return jsonify(tb)
+    return orjson_response(tb)
 
 @app.route('/api/reports/income-statement', methods=['GET'])
+@cached('journal', ttl=300)
 def report_income_statement():
     """Income statement report"""
     is_data = ReportService.get_income_statement()
-    return jsonify(is_data)
+    return orjson_response(is_data)
 
 @app.route('/api/reports/balance-sheet', methods=['GET'])
+@cached('journal', ttl=300)
 def report_balance_sheet():
     """Balance sheet report"""
     bs = ReportService.get_balance_sheet()
-    return jsonify(bs)
+    return orjson_response(bs)
 
 # ============= BACKUP/RESTORE APIs =============
 
 @app.route('/api/backup/export', methods=['GET'])
 def export_backup():
-    """Export all data as JSON"""
-    data = {
-        'config': {
-            'functionalCurrency': Config.query.first().functional_currency,
-            'vatRate': Config.query.first().vat_rate,
-            'costing': Config.query.first().costing
-        },
-        'branches': [{'id': b.id, 'name': b.name} for b in Branch.query.all()],
-        'costCenters': [{'id': c.id, 'name': c.name} for c in CostCenter.query.all()],
-        'currencies': [{'code': c.code, 'name': c.name, 'functional': c.functional} for c in Currency.query.all()],
-        'items': [{
-            'sku': i.sku, 'name': i.name, 'uom': i.uom, 'cat4': i.cat4, 'cat5': i.cat5
-        } for i in Item.query.all()],
-        'prices': {p.sku: p.price for p in Price.query.all()},
-        'itemMap': {
-            m.category: {
+    """Export all data as NDJSON, streamed one record per line
+
+    Each line is {"section": ..., "data": ...}; records of object sections
+    (config, prices, itemMap, stockBatches) also carry a "key". Clients rebuild
+    the backup object by pushing to / assigning into data[section].
+    """
+    def generate():
+        yield ndjson_line({'format': 'accounting-backup', 'version': 1})
+
+        for key, value in (get_config_cached() or {}).items():
+            yield ndjson_line({'section': 'config', 'key': key, 'data': value})
+        for b in Branch.query.yield_per(1000):
+            yield ndjson_line({'section': 'branches', 'data': {'id': b.id, 'name': b.name}})
+        for c in CostCenter.query.yield_per(1000):
+            yield ndjson_line({'section': 'costCenters', 'data': {'id': c.id, 'name': c.name}})
+        for c in Currency.query.yield_per(1000):
+            yield ndjson_line({'section': 'currencies', 'data': {'code': c.code, 'name': c.name, 'functional': c.functional}})
+        for i in Item.query.yield_per(1000):
+            yield ndjson_line({'section': 'items', 'data': {
+                'sku': i.sku, 'name': i.name, 'uom': i.uom, 'cat4': i.cat4, 'cat5': i.cat5
+            }})
+        for sku, price in db.session.execute(PRICES_SELECT):
+            yield ndjson_line({'section': 'prices', 'key': sku, 'data': price})
+        for m in ItemGLMapping.query.yield_per(1000):
+            yield ndjson_line({'section': 'itemMap', 'key': m.category, 'data': {
                 'inv': m.inv_account,
                 'sales': m.sales_account,
                 'cogs': m.cogs_account
-            } for m in ItemGLMapping.query.all()
-        },
-        'coa': [{'code': a.code, 'name': a.name, 'side': a.side} for a in ChartOfAccount.query.all()],
-        'taxes': [{'code': t.code, 'type': t.type, 'rate': t.rate} for t in TaxCode.query.all()],
-        'journal': [{
-            'docDate': j.doc_date,
-            'docNo': j.doc_no,
-            'acc': j.acc,
-            'debit': j.debit,
-            'credit': j.credit,
-            'branch': j.branch,
-            'cc': j.cc
-        } for j in JournalEntry.query.all()],
-        'stockBatches': {}
-    }
-
-    # Group stock batches by SKU
-    batches = StockBatch.query.all()
-    for batch in batches:
-        if batch.sku not in data['stockBatches']:
-            data['stockBatches'][batch.sku] = []
-        data['stockBatches'][batch.sku].append({
-            'qty': batch.qty,
-            'unitCost': batch.unit_cost
-        })
-
-    return jsonify(data)
+            }})
+        for a in ChartOfAccount.query.yield_per(1000):
+            yield ndjson_line({'section': 'coa', 'data': {'code': a.code, 'name': a.name, 'side': a.side}})
+        for t in TaxCode.query.yield_per(1000):
+            yield ndjson_line({'section': 'taxes', 'data': {'code': t.code, 'type': t.type, 'rate': t.rate}})
+        for j in JournalEntry.query.yield_per(1000):
+            yield ndjson_line({'section': 'journal', 'data': {
+                'docDate': j.doc_date,
+                'docNo': j.doc_no,
+                'acc': j.acc,
+                'debit': j.debit,
+                'credit': j.credit,
+                'branch': j.branch,
+                'cc': j.cc
+            }})
+
+        # Group stock batches by SKU
+        stock_batches = defaultdict(list)
+        for batch in StockBatch.query.yield_per(1000):
+            stock_batches[batch.sku].append({
+                'qty': batch.qty,
+                'unitCost': batch.unit_cost
+            })
+        for sku, batches in stock_batches.items():
+            yield ndjson_line({'section': 'stockBatches', 'key': sku, 'data': batches})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/backup/import', methods=['POST'])
 def import_backup():
@@ -641,79 +782,107 @@ def import_backup():
     try:
         data = request.json
 
-        # Clear existing data
-        db.session.query(DocumentLine).delete()
-        db.session.query(Document).delete()
-        db.session.query(JournalEntry).delete()
-        db.session.query(StockBatch).delete()
-        db.session.commit()
-
-        # Import journal entries
-        if 'journal' in data:
-            for j in data['journal']:
-                entry = JournalEntry(
-                    doc_date=j['docDate'],
-                    doc_no=j['docNo'],
-                    acc=j['acc'],
-                    debit=j['debit'],
-                    credit=j['credit'],
-                    branch=j.get('branch', ''),
-                    cc=j.get('cc', '')
-                )
-                db.session.add(entry)
-
-        # Import stock batches
-        if 'stockBatches' in data:
-            for sku, batches in data['stockBatches'].items():
-                for batch in batches:
-                    stock_batch = StockBatch(
-                        sku=sku,
-                        qty=batch['qty'],
-                        unit_cost=batch['unitCost']
-                    )
-                    db.session.add(stock_batch)
-
-        db.session.commit()
-
-        return jsonify({'success': True, 'message': 'تم الاستيراد بنجاح'})
+        # Clear and reload in one transaction: a single COMMIT for the whole import
+        with write_transaction():
+            # Clear existing data
+            db.session.query(DocumentLine).delete(synchronize_session=False)
+            db.session.query(Document).delete(synchronize_session=False)
+            db.session.query(JournalEntry).delete(synchronize_session=False)
+            db.session.query(StockBatch).delete(synchronize_session=False)
+
+            # Import journal entries
+            if 'journal' in data:
+                AccountingService.bulk_post_lines({
+                    'doc_date': j['docDate'],
+                    'doc_no': j['docNo'],
+                    'acc': j['acc'],
+                    'debit': j['debit'],
+                    'credit': j['credit'],
+                    'branch': j.get('branch', ''),
+                    'cc': j.get('cc', '')
+                } for j in data['journal'])
+
+            # Import stock batches
+            if 'stockBatches' in data:
+                db.session.bulk_insert_mappings(StockBatch, [{
+                    'sku': sku,
+                    'qty': batch['qty'],
+                    'unit_cost': batch['unitCost']
+                } for sku, batches in data['stockBatches'].items() for batch in batches])
+
+            # Refresh planner statistics so SQLite picks the indexes for the new data
+            db.session.execute(text('ANALYZE'))
+
+        invalidate('journal')
+
+        return orjson_response({'success': True, 'message': 'تم الاستيراد بنجاح'})
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 @app.route('/api/reset', methods=['POST'])
 def reset_data():
     """Reset all transactional data (keep master data)"""
     try:
-        db.session.query(DocumentLine).delete()
-        db.session.query(Document).delete()
-        db.session.query(JournalEntry).delete()
-        db.session.query(StockBatch).delete()
-        db.session.query(DocumentSequence).delete()
-        db.session.commit()
+        with write_transaction():
+            db.session.query(DocumentLine).delete(synchronize_session=False)
+            db.session.query(Document).delete(synchronize_session=False)
+            db.session.query(JournalEntry).delete(synchronize_session=False)
+            db.session.query(StockBatch).delete(synchronize_session=False)
+            # document_sequences is kept: numbering continues after a reset, so blocks
+            # still held by other workers can never collide with new documents
+
+        invalidate('journal')
 
-        return jsonify({'success': True, 'message': 'تم إعادة التعيين'})
+        return orjson_response({'success': True, 'message': 'تم إعادة التعيين'})
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 400
+        return orjson_response({'success': False, 'error': str(e)}, 400)
 
 # ============= ERROR HANDLERS =============
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({'error': 'Not found'}), 404
+    return orjson_response({'error': 'Not found'}, 404)
 
 @app.errorhandler(500)
 def server_error(e):
-    return jsonify({'error': 'Internal server error'}), 500
+    return orjson_response({'error': 'Internal server error'}, 500)
+
+# ============= CLI =============
+
+# Indexes replaced by wider ones; dropped from databases created before the change
+RETIRED_INDEXES = ('ix_sb_sku',)
+
+def create_schema():
+    """Create missing tables and indexes
+
+    create_all() skips tables that already exist, so indexes added to existing
+    models are created here one by one.
+    """
+    db.create_all()
+    with db.engine.begin() as conn:
+        for name in RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+@app.cli.command('init-db')
+def init_db():
+    """Create database tables and indexes (run once before starting gunicorn workers)"""
+    create_schema()
+    print("Database initialized!")
 
 # ============= MAIN =============
 
 if __name__ == '__main__':
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
     with app.app_context():
-        db.create_all()
+        create_schema()
         print("Database initialized!")
         print("Starting Flask server on http://localhost:4550")
 
-    app.run(debug=True, host='0.0.0.0', port=4550)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=4550)
@@ -0,0 +1,89 @@
+"""
+Redis-backed response cache and document number counters
+
+Redis is used only when REDIS_URL is set (e.g. redis://localhost:6379/0).
+Without it, or if Redis is unreachable, cached GETs fall through to the database.
+Document number counters are authoritative while Redis is enabled, so their
+errors are raised rather than swallowed.
+"""
+from flask import request, current_app
+from functools import wraps
+import os
+import redis
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+redis_client = redis.Redis.from_url(
+    REDIS_URL,
+    socket_timeout=0.5,
+    socket_connect_timeout=0.5
+) if REDIS_URL else None
+
+def cached(prefix, ttl):
+    """Cache a view's serialized JSON body in Redis under prefix for ttl seconds"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if redis_client is None:
+                return view(*args, **kwargs)
+
+            try:
+                key = f"{prefix}:v{_version(prefix)}:{request.full_path}"
+                body = redis_client.get(key)
+            except redis.RedisError:
+                return view(*args, **kwargs)
+
+            # Hits return the stored body verbatim, with no decode/re-encode
+            if body is not None:
+                return current_app.response_class(body, mimetype='application/json')
+
+            response = view(*args, **kwargs)
+            if response.status_code == 200:
+                try:
+                    redis_client.setex(key, ttl, response.get_data())
+                except redis.RedisError:
+                    pass
+            return response
+        return wrapper
+    return decorator
+
+def _version(prefix):
+    """Current cache generation for prefix; part of every key under it"""
+    return int(redis_client.get(f"{prefix}:ver") or 0)
+
+def invalidate(*prefixes):
+    """Drop all cached responses under the given prefixes
+
+    Bumps the prefix version instead of scanning for keys: entries of the old
+    version are never read again and expire on their TTL.
+    """
+    if redis_client is None:
+        return
+
+    try:
+        for prefix in prefixes:
+            redis_client.incr(f"{prefix}:ver")
+    except redis.RedisError:
+        pass
+
+# ============= DOCUMENT SEQUENCES =============
+
+# Raise a counter to ARGV[1] unless it is already higher
+_SEED_SEQUENCE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+"""
+
+def sequences_enabled():
+    """Whether document numbers are allocated from Redis"""
+    return redis_client is not None
+
+def seed_sequence(prefix, last_number):
+    """Make sure the counter for prefix is at least last_number"""
+    redis_client.eval(_SEED_SEQUENCE_SCRIPT, 1, f"seq:{prefix}", last_number)
+
+def incr_sequence(prefix):
+    """Atomically allocate the next number for prefix"""
+    return redis_client.incr(f"seq:{prefix}")
@@ -0,0 +1,16 @@
+"""
+Gunicorn settings for serving the accounting backend
+
+Run from the backend directory:
+    flask --app app init-db
+    gunicorn app:app
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:4550')
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Keep client connections open between requests (the frontend issues bursts of API calls)
+keepalive = 5
@@ -0,0 +1,36 @@
+"""
+orjson-based JSON serialization for API responses
+"""
+from flask import current_app
+from flask.json.provider import JSONProvider
+from decimal import Decimal
+import orjson
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def _default(obj):
+    """Serialize types orjson has no native support for (Numeric columns give Decimal)"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider that delegates to orjson (request.json, jsonify)"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def orjson_response(data, status=200):
+    """Serialize data with orjson and wrap it in a JSON response"""
+    return current_app.response_class(
+        orjson.dumps(data, default=_default, option=ORJSON_OPTIONS),
+        status=status,
+        mimetype='application/json'
+    )
+
+def ndjson_line(data):
+    """Serialize one record as a newline-terminated NDJSON line"""
+    return orjson.dumps(data, default=_default, option=ORJSON_OPTIONS) + b'\n'
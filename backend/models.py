@@ -44,6 +44,10 @@ class Price(db.Model):
     sku = db.Column(db.String(50), db.ForeignKey('items.sku'), nullable=False)
     price = db.Column(db.Float, nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_prices_sku', 'sku', 'price'),
+    )
+
 class ItemGLMapping(db.Model):
     __tablename__ = 'item_gl_mapping'
     id = db.Column(db.Integer, primary_key=True)
@@ -73,12 +77,19 @@ class JournalEntry(db.Model):
     doc_date = db.Column(db.String(10), nullable=False)
     doc_no = db.Column(db.String(50), nullable=False)
     acc = db.Column(db.String(50), nullable=False)
-    debit = db.Column(db.Float, default=0)
-    credit = db.Column(db.Float, default=0)
+    debit = db.Column(db.Numeric(18, 4), default=0)
+    credit = db.Column(db.Numeric(18, 4), default=0)
     branch = db.Column(db.String(100), default='')
     cc = db.Column(db.String(20), default='')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_je_date_branch_cc', 'doc_date', 'branch', 'cc'),
+        db.Index('ix_je_acc_date', 'acc', 'doc_date'),
+        db.Index('ix_je_branch_cc_date', 'branch', 'cc', 'doc_date'),
+        db.Index('ix_je_created_desc', db.desc('created_at'), db.desc('id')),
+    )
+
 class Document(db.Model):
     __tablename__ = 'documents'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -92,6 +103,11 @@ class Document(db.Model):
     vat = db.Column(db.Float, default=0)
     total = db.Column(db.Float, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    lines = db.relationship('DocumentLine', backref='document', order_by='DocumentLine.id')
+
+    __table_args__ = (
+        db.Index('ix_doc_created', 'created_at'),
+    )
 
 class DocumentLine(db.Model):
     __tablename__ = 'document_lines'
@@ -104,14 +120,22 @@ class DocumentLine(db.Model):
     price = db.Column(db.Float)
     net = db.Column(db.Float)
 
+    __table_args__ = (
+        db.Index('ix_line_doc', 'doc_no'),
+    )
+
 class StockBatch(db.Model):
     __tablename__ = 'stock_batches'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     sku = db.Column(db.String(50), db.ForeignKey('items.sku'), nullable=False)
-    qty = db.Column(db.Float, nullable=False)
-    unit_cost = db.Column(db.Float, nullable=False)
+    qty = db.Column(db.Numeric(18, 4), nullable=False)
+    unit_cost = db.Column(db.Numeric(18, 4), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_sb_sku_created', 'sku', 'created_at'),
+    )
+
 class DocumentSequence(db.Model):
     __tablename__ = 'document_sequences'
     id = db.Column(db.Integer, primary_key=True)
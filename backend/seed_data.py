@@ -3,12 +3,16 @@ Seed database with demo data from the original static app
 """
 from app import app
 from models import *
+from cache import invalidate
 
 def seed_database():
     """Populate database with demo data"""
     with app.app_context():
-        # Drop all tables and recreate
-        db.drop_all()
+        # Drop all tables and recreate; document_sequences is kept so numbering
+        # continues, and blocks held by running workers never collide
+        db.metadata.drop_all(db.engine, tables=[
+            t for t in db.metadata.sorted_tables if t.name != DocumentSequence.__tablename__
+        ])
         db.create_all()
 
         print("Seeding database with demo data...")
@@ -189,6 +193,7 @@ def seed_database():
             db.session.add(tax)
 
         db.session.commit()
+        invalidate('master', 'journal')
         print("Database seeded successfully!")
         print(f"  - {len(branches_data)} branches")
         print(f"  - {len(cost_centers)} cost centers")
@@ -2,131 +2,373 @@
 Business logic for accounting operations
 """
 from models import db, JournalEntry, StockBatch, DocumentSequence, Item, ItemGLMapping, ChartOfAccount
+from cache import sequences_enabled, seed_sequence, incr_sequence
+from sqlalchemy import case, event, func, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from itertools import islice
+import sys
+import threading
+import time
+
+# ============= ACCOUNTS =============
+
+# Fixed accounts posted by the vouchers; interned since they're stored on every line
+CASH_ACC = sys.intern("1-01-01-001-001")
+BANK_ACC = sys.intern("1-01-02-001-001")
+AR_ACC = sys.intern("1-02-01-000-000")
+AP_ACC = sys.intern("2-01-01-000-000")
+VAT_OUTPUT_ACC = sys.intern("2-02-01-001-000")
+VAT_INPUT_ACC = sys.intern("2-03-01-001-000")
+SALES_RETURNS_ACC = sys.intern("4-02-01-000-000")
+
+# GL accounts for items whose category has no mapping
+DEFAULT_CATEGORY = "أجهزة صغيرة"
+DEFAULT_GL_ACCOUNTS = {
+    'inv': sys.intern("1-03-02-010-000"),
+    'sales': sys.intern("4-01-02-001-000"),
+    'cogs': sys.intern("5-01-02-001-000")
+}
+
+# Amounts are rounded half-up to CENT; FIFO costs are kept to the column scale
+CENT = Decimal('0.01')
+SCALE = Decimal('0.0001')
+
+def to_decimal(value):
+    """Exact Decimal for a request number (int, float or numeric string)
+
+    Raises ValueError for a missing (None) or non-numeric value.
+    """
+    if isinstance(value, Decimal):
+        return value
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValueError(f"قيمة رقمية غير صالحة: {value}")
+    return number
+
+# ============= DOCUMENT SEQUENCE STATEMENTS =============
+
+# Document numbers reserved per round-trip to document_sequences
+SEQUENCE_BLOCK = 50
+
+# Advance a sequence by :count, creating it at 1 if missing, and return the
+# first number of the reserved block
+RESERVE_SEQUENCE_SQL = text("""
+    INSERT INTO document_sequences (prefix, next_number) VALUES (:prefix, 1 + :count)
+    ON CONFLICT (prefix) DO UPDATE SET next_number = document_sequences.next_number + :count
+    RETURNING next_number - :count
+""")
+
+# ============= FIFO STATEMENTS =============
+
+# The SKU's batches in FIFO order with the running quantity up to and including
+# each, walked one ix_sb_sku_created step at a time and stopped at the first batch
+# that covers :need, so the work grows with the batches a sale reaches rather than
+# with all the SKU's batches. Used as WITH RECURSIVE {_FIFO_RUNNING}.
+_FIFO_RUNNING = """
+    c(id, created_at, qty, unit_cost, cum) AS (
+        SELECT * FROM (
+            SELECT id, created_at, qty, unit_cost, qty FROM stock_batches
+            WHERE sku = :sku ORDER BY created_at, id LIMIT 1
+        )
+        UNION ALL
+        SELECT b.id, b.created_at, b.qty, b.unit_cost, c.cum + b.qty
+        FROM c JOIN stock_batches b ON b.id = (
+            SELECT n.id FROM stock_batches n
+            WHERE n.sku = :sku AND (n.created_at, n.id) > (c.created_at, c.id)
+            ORDER BY n.created_at, n.id LIMIT 1
+        )
+        WHERE c.cum < :need
+    )
+"""
+
+# Cost of :need over the batches it reaches (cum - qty < :need) and how many
+# of them are used up
+_FIFO_PLAN = """
+    SELECT COALESCE(SUM(MIN(qty, :need - (cum - qty)) * unit_cost), 0) AS cost,
+           COALESCE(SUM(cum <= :need), 0) AS consumed
+    FROM c
+    WHERE cum - qty < :need
+"""
+
+FIFO_PLAN_SQL = text(f"WITH RECURSIVE {_FIFO_RUNNING} {_FIFO_PLAN}")
+
+# The item's category and name together with its FIFO plan, for post_sale; reads
+# the item row and only the batches the sale reaches
+SALE_CONTEXT_SQL = text(f"""
+    WITH RECURSIVE {_FIFO_RUNNING}, p AS ({_FIFO_PLAN})
+    SELECT items.cat5, items.name, p.cost, p.consumed
+    FROM items, p
+    WHERE items.sku = :sku
+""")
+
+# Batches fully consumed by :need, returning how much they held
+FIFO_DELETE_SQL = text(f"""
+    WITH RECURSIVE {_FIFO_RUNNING}
+    DELETE FROM stock_batches WHERE id IN (SELECT id FROM c WHERE cum <= :need)
+    RETURNING qty
+""")
+
+# Take :rest from the oldest batch left, which covers it if stock suffices
+FIFO_UPDATE_SQL = text("""
+    UPDATE stock_batches SET qty = qty - :rest
+    WHERE id = (SELECT id FROM stock_batches WHERE sku = :sku ORDER BY created_at, id LIMIT 1)
+      AND qty > :rest
+""")
+
+# Shortfalls below this are float noise, not missing stock
+QTY_EPSILON = 1e-9
+
+# GL accounts per item category (see AccountingService.get_gl_mapping)
+_gl_cache = {'v': None, 'ts': 0}
 
 class AccountingService:
 
     @staticmethod
     def get_next_doc_number(prefix):
-        """Generate next document number with auto-increment"""
-        seq = DocumentSequence.query.filter_by(prefix=prefix).first()
-        if not seq:
-            seq = DocumentSequence(prefix=prefix, next_number=1)
-            db.session.add(seq)
+        """Generate next document number with auto-increment
+
+        Without Redis, numbers are handed out from a block reserved in
+        document_sequences (see _reserve_numbers), so most calls run no SQL.
+        Numbers of failed vouchers and unused numbers of a block left behind at
+        shutdown are skipped, not reused.
+        """
+        if sequences_enabled():
+            number = AccountingService._next_redis_number(prefix)
+        else:
+            number = AccountingService._next_block_number(prefix)
+
+        return f"{prefix}-{number:06d}"
 
-        doc_no = f"{prefix}-{seq.next_number:06d}"
-        seq.next_number += 1
-        db.session.commit()
-        return doc_no
+    # Reserved document numbers per prefix: prefix -> (next, end), end exclusive.
+    # Only blocks whose reservation has committed are published here.
+    _seq_cache = {}
+    _seq_lock = threading.Lock()
+
+    @staticmethod
+    def _next_block_number(prefix):
+        """Take the next number from this process's block, reserving a new one if used up
+
+        A new block is reserved inside the caller's transaction and kept in
+        session.info until it commits (see _publish_reserved_blocks); if the
+        voucher rolls back, so does the reservation, and nothing is cached.
+        """
+        pending = db.session.info.setdefault('reserved_blocks', {})
+        if prefix in pending:
+            number, end = pending[prefix]
+            pending[prefix] = (number + 1, end)
+            return number
+
+        with AccountingService._seq_lock:
+            number, end = AccountingService._seq_cache.get(prefix, (0, 0))
+            if number < end:
+                AccountingService._seq_cache[prefix] = (number + 1, end)
+                return number
+
+        number = AccountingService._reserve_numbers(prefix, SEQUENCE_BLOCK)
+        pending[prefix] = (number + 1, number + SEQUENCE_BLOCK)
+        return number
+
+    @staticmethod
+    def _reserve_numbers(prefix, count):
+        """Reserve count consecutive numbers for prefix and return the first"""
+        return db.session.execute(RESERVE_SEQUENCE_SQL, {'prefix': prefix, 'count': count}).scalar_one()
+
+    @staticmethod
+    def _next_redis_number(prefix):
+        """Allocate a number with Redis INCR and record it in document_sequences
+
+        The high-water mark is written back with a blind upsert (no SELECT) inside
+        the voucher's transaction, so the database stays the durable record. The
+        upsert returns the database's mark: if Redis is behind it (first use, or a
+        flushed/restarted Redis) the counter is raised to it and INCR is retried.
+        """
+        while True:
+            number = incr_sequence(prefix)
+
+            stmt = sqlite_insert(DocumentSequence).values(prefix=prefix, next_number=number + 1)
+            high = db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['prefix'],
+                set_={'next_number': func.max(DocumentSequence.next_number, stmt.excluded.next_number)}
+            ).returning(DocumentSequence.next_number)).scalar_one()
+
+            if high <= number + 1:
+                return number
+            seed_sequence(prefix, high - 1)
 
     @staticmethod
     def post_line(doc_date, doc_no, acc, debit, credit, branch='', cc=''):
-        """Post a journal entry line"""
-        entry = JournalEntry(
-            doc_date=doc_date,
-            doc_no=doc_no,
-            acc=acc,
-            debit=float(debit or 0),
-            credit=float(credit or 0),
-            branch=branch or '',
-            cc=cc or ''
-        )
-        db.session.add(entry)
+        """Build a journal entry line (insert with post_lines)"""
+        return {
+            'doc_date': doc_date,
+            'doc_no': doc_no,
+            'acc': acc,
+            'debit': debit or 0,
+            'credit': credit or 0,
+            'branch': branch or '',
+            'cc': cc or ''
+        }
+
+    @staticmethod
+    def post_lines(lines):
+        """Insert a voucher's journal entry lines in one batched INSERT"""
+        db.session.bulk_insert_mappings(JournalEntry, lines)
+
+    @staticmethod
+    def bulk_post_lines(rows, chunk_size=1000):
+        """Insert many journal entry rows (dicts of column values) with Core inserts
+
+        For imports: skips the ORM entirely and executes chunk_size rows per
+        executemany, so rows may be a generator and is never held in memory whole.
+        """
+        insert = JournalEntry.__table__.insert()
+        rows = iter(rows)
+        while chunk := list(islice(rows, chunk_size)):
+            db.session.execute(insert, chunk)
 
     @staticmethod
     def fifo_add(sku, qty, unit_cost):
         """Add inventory batch for FIFO costing"""
         batch = StockBatch(
             sku=sku,
-            qty=float(qty),
-            unit_cost=float(unit_cost)
+            qty=to_decimal(qty),
+            unit_cost=to_decimal(unit_cost)
         )
         db.session.add(batch)
 
     @staticmethod
-    def fifo_consume(sku, qty):
-        """Consume inventory using FIFO and return total cost"""
+    def fifo_consume(sku, qty, plan=None):
+        """Consume inventory using FIFO and return total cost
+
+        Runs as a fixed set of statements over the running quantity of the
+        batches qty reaches (the SKU's other batches are never read) instead of
+        loading and mutating them one by one. As before, whatever stock exists
+        is consumed even when it falls short of qty; the caller's transaction
+        decides whether that sticks. plan is a row already read for the same sku
+        and qty in the current transaction (see prepare_sale_context).
+        """
+        # Bound as REAL: sqlite3 can't bind Decimal to textual SQL
         need = float(qty)
-        cost = 0
+        params = {'sku': sku, 'need': need}
+
+        if plan is None:
+            plan = db.session.execute(FIFO_PLAN_SQL, params).one()
+
+        # Only the batches the plan reaches are written; usually one UPDATE or DELETE.
+        # The remainder is taken relative to the stored qty, never as a value read earlier
+        rest = need
+        if plan.consumed:
+            rest -= sum(db.session.execute(FIFO_DELETE_SQL, params).scalars())
+        if rest > QTY_EPSILON:
+            updated = db.session.execute(FIFO_UPDATE_SQL, {'sku': sku, 'rest': rest}).rowcount
+            if not updated:
+                raise ValueError(f"كمية غير كافية للصنف: {sku}")
+
+        return to_decimal(plan.cost).quantize(SCALE)
+
+    @staticmethod
+    def get_gl_mapping(cat5):
+        """Get GL accounts for an item category"""
+        gl_cache = AccountingService._load_gl_cache()
 
-        # Get batches ordered by creation date (FIFO)
-        batches = StockBatch.query.filter_by(sku=sku).order_by(StockBatch.created_at).all()
+        # Fallback to default, then to the hard-coded accounts
+        return gl_cache.get(cat5) or gl_cache.get(DEFAULT_CATEGORY) or DEFAULT_GL_ACCOUNTS
 
-        for batch in batches:
-            if need <= 0:
-                break
+    @staticmethod
+    def get_item_with_mapping(sku):
+        """Get an item's (cat5, name) row and its GL accounts as (item, gl_map)
 
-            take = min(need, batch.qty)
-            cost += take * batch.unit_cost
-            batch.qty -= take
-            need -= take
+        item is None if the SKU is unknown. GL mappings come from the process
+        cache, so this costs one narrow item query.
+        """
+        item = db.session.query(Item.cat5, Item.name).filter_by(sku=sku).first()
+        gl_map = AccountingService.get_gl_mapping(item.cat5 if item else None)
+        return item, gl_map
 
-            if batch.qty <= 0:
-                db.session.delete(batch)
+    @staticmethod
+    def prepare_sale_context(sku, qty):
+        """Read what post_sale needs in one query: (item, gl_map, fifo_plan)
 
-        if need > 0:
-            raise ValueError(f"كمية غير كافية للصنف: {sku}")
+        The plan covers only the batches qty reaches, as in fifo_consume, so
+        the round-trip costs the same however many batches the SKU has.
 
-        return cost
+        item is None (and so are the others) if the SKU is unknown; fifo_plan is
+        passed on to fifo_consume.
+        """
+        row = db.session.execute(SALE_CONTEXT_SQL, {'sku': sku, 'need': float(qty)}).first()
+        if row is None:
+            return None, None, None
+        return row, AccountingService.get_gl_mapping(row.cat5), row
 
     @staticmethod
-    def get_gl_mapping(cat5):
-        """Get GL accounts for an item category"""
-        mapping = ItemGLMapping.query.filter_by(category=cat5).first()
-        if not mapping:
-            # Fallback to default
-            mapping = ItemGLMapping.query.filter_by(category="أجهزة صغيرة").first()
-
-        if mapping:
-            return {
-                'inv': mapping.inv_account,
-                'sales': mapping.sales_account,
-                'cogs': mapping.cogs_account
-            }
-        else:
-            # Hard fallback
-            return {
-                'inv': '1-03-02-010-000',
-                'sales': '4-01-02-001-000',
-                'cogs': '5-01-02-001-000'
+    def _load_gl_cache(ttl=60):
+        """Category -> GL accounts, re-read from ItemGLMapping at most every ttl seconds
+
+        Mappings are only written by seed_data in its own process, so they are
+        picked up by expiry rather than explicit invalidation.
+        """
+        now = time.time()
+        if _gl_cache['v'] is None or now - _gl_cache['ts'] > ttl:
+            _gl_cache['v'] = {
+                m.category: {
+                    'inv': m.inv_account,
+                    'sales': m.sales_account,
+                    'cogs': m.cogs_account
+                }
+                for m in ItemGLMapping.query.all()
             }
+            _gl_cache['ts'] = now
+        return _gl_cache['v']
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_reserved_blocks(session):
+    """Hand blocks reserved by the committed transaction to later vouchers"""
+    blocks = session.info.pop('reserved_blocks', None)
+    if blocks:
+        with AccountingService._seq_lock:
+            AccountingService._seq_cache.update(blocks)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_reserved_blocks(session):
+    """Drop blocks whose reservation was rolled back"""
+    session.info.pop('reserved_blocks', None)
 
 class VoucherService:
 
     @staticmethod
     def post_sale(date, branch, cc, sku, qty, price, cash_or_ar, currency, vat_rate):
         """Post a sales invoice with FIFO COGS calculation"""
-        # Get item details
-        item = Item.query.filter_by(sku=sku).first()
+        qty, price = to_decimal(qty), to_decimal(price)
+
+        # Get item details, GL mapping and the FIFO plan
+        item, gl_map, fifo_plan = AccountingService.prepare_sale_context(sku, qty)
         if not item:
             raise ValueError("صنف غير معروف")
 
-        # Get GL mapping
-        gl_map = AccountingService.get_gl_mapping(item.cat5)
-
         # Generate document number
         doc_no = AccountingService.get_next_doc_number('AR')
 
         # Calculate amounts
-        base = round(float(qty) * float(price), 2)
-        vat = round(base * float(vat_rate), 2)
+        base = (qty * price).quantize(CENT, ROUND_HALF_UP)
+        vat = (base * to_decimal(vat_rate)).quantize(CENT, ROUND_HALF_UP)
         total = base + vat
 
-        # Account codes
-        cash_acc = "1-01-01-001-001"
-        ar_acc = "1-02-01-000-000"
-        vat_output_acc = "2-02-01-001-000"
-
         # Post revenue entries
-        debit_acc = cash_acc if cash_or_ar == "نقدي" else ar_acc
-        AccountingService.post_line(date, doc_no, debit_acc, total, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, gl_map['sales'], 0, base, branch, cc)
-        AccountingService.post_line(date, doc_no, vat_output_acc, 0, vat, branch, cc)
+        lines = []
+        debit_acc = CASH_ACC if cash_or_ar == "نقدي" else AR_ACC
+        lines.append(AccountingService.post_line(date, doc_no, debit_acc, total, 0, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['sales'], 0, base, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, VAT_OUTPUT_ACC, 0, vat, branch, cc))
 
         # Calculate and post COGS
-        cogs_cost = AccountingService.fifo_consume(sku, qty)
-        AccountingService.post_line(date, doc_no, gl_map['cogs'], cogs_cost, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, gl_map['inv'], 0, cogs_cost, branch, cc)
+        cogs_cost = AccountingService.fifo_consume(sku, qty, fifo_plan)
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['cogs'], cogs_cost, 0, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['inv'], 0, cogs_cost, branch, cc))
+        AccountingService.post_lines(lines)
 
         return {
             'doc_no': doc_no,
@@ -140,32 +382,29 @@ class VoucherService:
     @staticmethod
     def post_purchase(date, branch, cc, sku, qty, price, payment_type, supplier_acc, vat_rate):
         """Post a purchase invoice"""
-        # Get item details
-        item = Item.query.filter_by(sku=sku).first()
+        qty, price = to_decimal(qty), to_decimal(price)
+
+        # Get item details and GL mapping
+        item, gl_map = AccountingService.get_item_with_mapping(sku)
         if not item:
             raise ValueError("صنف غير معروف")
 
-        # Get GL mapping
-        gl_map = AccountingService.get_gl_mapping(item.cat5)
-
         # Generate document number
         doc_no = AccountingService.get_next_doc_number('AP')
 
         # Calculate amounts
-        base = round(float(qty) * float(price), 2)
-        vat = round(base * float(vat_rate), 2)
+        base = (qty * price).quantize(CENT, ROUND_HALF_UP)
+        vat = (base * to_decimal(vat_rate)).quantize(CENT, ROUND_HALF_UP)
         total = base + vat
 
-        # Account codes
-        bank_acc = "1-01-02-001-001"
-        vat_input_acc = "2-03-01-001-000"
-
         # Post entries
-        AccountingService.post_line(date, doc_no, gl_map['inv'], base, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, vat_input_acc, vat, 0, branch, cc)
+        lines = []
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['inv'], base, 0, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, VAT_INPUT_ACC, vat, 0, branch, cc))
 
-        credit_acc = bank_acc if payment_type == "نقدي" else (supplier_acc or "2-01-01-000-000")
-        AccountingService.post_line(date, doc_no, credit_acc, 0, total, branch, cc)
+        credit_acc = BANK_ACC if payment_type == "نقدي" else (supplier_acc or AP_ACC)
+        lines.append(AccountingService.post_line(date, doc_no, credit_acc, 0, total, branch, cc))
+        AccountingService.post_lines(lines)
 
         # Add to FIFO inventory
         AccountingService.fifo_add(sku, qty, price)
@@ -181,71 +420,78 @@ class VoucherService:
     @staticmethod
     def post_receipt(date, from_acc, to_acc, amount, branch='', cc=''):
         """Post a receipt voucher"""
+        amount = to_decimal(amount)
+
         doc_no = AccountingService.get_next_doc_number('RC')
 
-        AccountingService.post_line(date, doc_no, to_acc, amount, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, from_acc, 0, amount, branch, cc)
+        AccountingService.post_lines([
+            AccountingService.post_line(date, doc_no, to_acc, amount, 0, branch, cc),
+            AccountingService.post_line(date, doc_no, from_acc, 0, amount, branch, cc)
+        ])
 
         return {'doc_no': doc_no, 'amount': amount}
 
     @staticmethod
     def post_payment(date, from_acc, to_acc, amount, branch='', cc=''):
         """Post a payment voucher"""
+        amount = to_decimal(amount)
+
         doc_no = AccountingService.get_next_doc_number('PY')
 
-        AccountingService.post_line(date, doc_no, to_acc, amount, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, from_acc, 0, amount, branch, cc)
+        AccountingService.post_lines([
+            AccountingService.post_line(date, doc_no, to_acc, amount, 0, branch, cc),
+            AccountingService.post_line(date, doc_no, from_acc, 0, amount, branch, cc)
+        ])
 
         return {'doc_no': doc_no, 'amount': amount}
 
     @staticmethod
     def post_journal(date, debit_acc, credit_acc, amount, branch='', cc=''):
         """Post a manual journal entry"""
+        amount = to_decimal(amount)
+
         doc_no = AccountingService.get_next_doc_number('JV')
 
-        AccountingService.post_line(date, doc_no, debit_acc, amount, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, credit_acc, 0, amount, branch, cc)
+        AccountingService.post_lines([
+            AccountingService.post_line(date, doc_no, debit_acc, amount, 0, branch, cc),
+            AccountingService.post_line(date, doc_no, credit_acc, 0, amount, branch, cc)
+        ])
 
         return {'doc_no': doc_no, 'amount': amount}
 
     @staticmethod
-    def post_sales_return(date, sku, qty, price, refund_type, vat_rate, branch='', cc=''):
-        """Post a sales return (credit note)"""
-        # Get item details
-        item = Item.query.filter_by(sku=sku).first()
-        if not item:
-            item = Item(sku=sku, name="", uom="قطعة", cat5="أجهزة صغيرة")
+    def post_sales_return(date, sku, qty, price, refund_type, vat_rate, branch='', cc='', cat5=None):
+        """Post a sales return (credit note); pass cat5 to skip the item lookup"""
+        qty, price = to_decimal(qty), to_decimal(price)
 
-        # Get GL mapping
-        gl_map = AccountingService.get_gl_mapping(item.cat5)
+        # Get GL mapping (unknown items use the default category)
+        if cat5 is None:
+            cat5 = db.session.query(Item.cat5).filter_by(sku=sku).scalar()
+        gl_map = AccountingService.get_gl_mapping(cat5)
 
         # Generate document number
         doc_no = AccountingService.get_next_doc_number('CRN')
 
         # Calculate amounts
-        base = round(float(qty) * float(price), 2)
-        vat = round(base * float(vat_rate), 2)
+        base = (qty * price).quantize(CENT, ROUND_HALF_UP)
+        vat = (base * to_decimal(vat_rate)).quantize(CENT, ROUND_HALF_UP)
         total = base + vat
 
-        # Account codes
-        returns_acc = "4-02-01-000-000"
-        vat_output_acc = "2-02-01-001-000"
-        cash_acc = "1-01-01-001-001"
-        ar_acc = "1-02-01-000-000"
-
         # Post return entries (reverse of sales)
-        AccountingService.post_line(date, doc_no, returns_acc, base, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, vat_output_acc, vat, 0, branch, cc)
+        lines = []
+        lines.append(AccountingService.post_line(date, doc_no, SALES_RETURNS_ACC, base, 0, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, VAT_OUTPUT_ACC, vat, 0, branch, cc))
 
-        credit_acc = cash_acc if refund_type == "نقدي" else ar_acc
-        AccountingService.post_line(date, doc_no, credit_acc, 0, total, branch, cc)
+        credit_acc = CASH_ACC if refund_type == "نقدي" else AR_ACC
+        lines.append(AccountingService.post_line(date, doc_no, credit_acc, 0, total, branch, cc))
 
         # Return inventory to stock
         AccountingService.fifo_add(sku, qty, price)
 
         # Reverse COGS
-        AccountingService.post_line(date, doc_no, gl_map['inv'], base, 0, branch, cc)
-        AccountingService.post_line(date, doc_no, gl_map['cogs'], 0, base, branch, cc)
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['inv'], base, 0, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['cogs'], 0, base, branch, cc))
+        AccountingService.post_lines(lines)
 
         return {
             'doc_no': doc_no,
@@ -255,31 +501,29 @@ class VoucherService:
         }
 
     @staticmethod
-    def post_purchase_return(date, sku, qty, price, supplier_acc, vat_rate, branch='', cc=''):
-        """Post a purchase return (debit note)"""
-        # Get item details
-        item = Item.query.filter_by(sku=sku).first()
-        if not item:
-            item = Item(sku=sku, name="", uom="قطعة", cat5="أجهزة صغيرة")
+    def post_purchase_return(date, sku, qty, price, supplier_acc, vat_rate, branch='', cc='', cat5=None):
+        """Post a purchase return (debit note); pass cat5 to skip the item lookup"""
+        qty, price = to_decimal(qty), to_decimal(price)
 
-        # Get GL mapping
-        gl_map = AccountingService.get_gl_mapping(item.cat5)
+        # Get GL mapping (unknown items use the default category)
+        if cat5 is None:
+            cat5 = db.session.query(Item.cat5).filter_by(sku=sku).scalar()
+        gl_map = AccountingService.get_gl_mapping(cat5)
 
         # Generate document number
         doc_no = AccountingService.get_next_doc_number('DRN')
 
         # Calculate amounts
-        base = round(float(qty) * float(price), 2)
-        vat = round(base * float(vat_rate), 2)
+        base = (qty * price).quantize(CENT, ROUND_HALF_UP)
+        vat = (base * to_decimal(vat_rate)).quantize(CENT, ROUND_HALF_UP)
         total = base + vat
 
-        # Account codes
-        vat_input_acc = "2-03-01-001-000"
-
         # Post return entries (reverse of purchase)
-        AccountingService.post_line(date, doc_no, gl_map['inv'], 0, base, branch, cc)
-        AccountingService.post_line(date, doc_no, vat_input_acc, 0, vat, branch, cc)
-        AccountingService.post_line(date, doc_no, supplier_acc or "2-01-01-000-000", total, 0, branch, cc)
+        lines = []
+        lines.append(AccountingService.post_line(date, doc_no, gl_map['inv'], 0, base, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, VAT_INPUT_ACC, 0, vat, branch, cc))
+        lines.append(AccountingService.post_line(date, doc_no, supplier_acc or AP_ACC, total, 0, branch, cc))
+        AccountingService.post_lines(lines)
 
         # Try to consume from FIFO (but don't fail if not available)
         try:
@@ -294,11 +538,21 @@ class VoucherService:
             'total': total
         }
 
+# Chart of accounts (see ReportService.get_chart)
+_coa_cache = {'v': None, 'ts': 0}
+
+# Balance sheet section by account code prefix
+BALANCE_SHEET_BUCKETS = {'1-': 'assets', '2-': 'liabilities', '3-': 'equity'}
+
 class ReportService:
 
     @staticmethod
-    def get_journal(from_date=None, to_date=None, branch=None, cc=None, limit=100):
-        """Get journal entries with optional filters"""
+    def get_journal(from_date=None, to_date=None, branch=None, cc=None, limit=100, cursor=None):
+        """Get journal entries with optional filters, newest first
+
+        cursor is the (created_at, id) of the last entry of the previous page
+        (see journal_cursor); the page continues right after it.
+        """
         query = JournalEntry.query
 
         if from_date:
@@ -309,57 +563,104 @@ class ReportService:
             query = query.filter(JournalEntry.branch == branch)
         if cc:
             query = query.filter(JournalEntry.cc == cc)
+        if cursor:
+            query = query.filter(tuple_(JournalEntry.created_at, JournalEntry.id) < cursor)
 
-        return query.order_by(JournalEntry.created_at.desc()).limit(limit).all()
+        return query.order_by(JournalEntry.created_at.desc(), JournalEntry.id.desc()).limit(limit).all()
+
+    @staticmethod
+    def journal_cursor(entry):
+        """Opaque page cursor pointing just past entry"""
+        return f"{entry.created_at.isoformat()}_{entry.id}"
+
+    @staticmethod
+    def parse_journal_cursor(cursor):
+        """(created_at, id) from a journal_cursor string"""
+        try:
+            created_at, entry_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(created_at), int(entry_id)
+        except ValueError:
+            raise ValueError("مؤشر الصفحة غير صالح")
 
     @staticmethod
     def get_ledger(account_code, from_date=None, to_date=None):
         """Get ledger for a specific account"""
-        query = JournalEntry.query.filter_by(acc=account_code)
+        order = (JournalEntry.doc_date, JournalEntry.created_at, JournalEntry.id)
+
+        # Running balance computed by the database over the filtered rows
+        balance = func.sum(JournalEntry.debit - JournalEntry.credit).over(order_by=order, rows=(None, 0))
+
+        query = db.session.query(
+            JournalEntry.doc_date,
+            JournalEntry.doc_no,
+            JournalEntry.debit,
+            JournalEntry.credit,
+            balance
+        ).filter_by(acc=account_code)
 
         if from_date:
             query = query.filter(JournalEntry.doc_date >= from_date)
         if to_date:
             query = query.filter(JournalEntry.doc_date <= to_date)
 
-        entries = query.order_by(JournalEntry.doc_date, JournalEntry.created_at).all()
+        # Stream in batches instead of materializing the account's whole history
+        rows = query.order_by(*order).execution_options(stream_results=True).yield_per(1000)
 
-        # Calculate running balance
-        balance = 0
-        result = []
-        for entry in entries:
-            balance += entry.debit - entry.credit
-            result.append({
-                'doc_date': entry.doc_date,
-                'doc_no': entry.doc_no,
-                'debit': entry.debit,
-                'credit': entry.credit,
-                'balance': balance
-            })
+        return [{
+            'doc_date': doc_date,
+            'doc_no': doc_no,
+            'debit': debit,
+            'credit': credit,
+            'balance': balance
+        } for doc_date, doc_no, debit, credit, balance in rows]
 
-        return result
+    @staticmethod
+    def get_chart(ttl=60):
+        """Chart of accounts as (code, name, side, bucket) tuples
+
+        bucket is the balance sheet section of the account ('assets',
+        'liabilities', 'equity') or None for income statement accounts. Cached
+        per process and re-read at most every ttl seconds.
+        """
+        now = time.time()
+        if _coa_cache['v'] is None or now - _coa_cache['ts'] > ttl:
+            rows = db.session.query(ChartOfAccount.code, ChartOfAccount.name, ChartOfAccount.side).all()
+            _coa_cache['v'] = [
+                (code, name, side, BALANCE_SHEET_BUCKETS.get(code[:2]))
+                for code, name, side in rows
+            ]
+            _coa_cache['ts'] = now
+        return _coa_cache['v']
+
+    @staticmethod
+    def get_account_totals():
+        """Total debit and credit per account code, in one GROUP BY query"""
+        rows = db.session.query(
+            JournalEntry.acc,
+            func.sum(JournalEntry.debit),
+            func.sum(JournalEntry.credit)
+        ).group_by(JournalEntry.acc).all()
+
+        return {acc: (debit, credit) for acc, debit, credit in rows}
 
     @staticmethod
     def get_trial_balance():
         """Generate trial balance"""
-        accounts = ChartOfAccount.query.all()
+        totals = ReportService.get_account_totals()
         result = []
 
-        for account in accounts:
-            entries = JournalEntry.query.filter_by(acc=account.code).all()
-
-            total_debit = sum(e.debit for e in entries)
-            total_credit = sum(e.credit for e in entries)
+        for code, name, side, _ in ReportService.get_chart():
+            total_debit, total_credit = totals.get(code, (0, 0))
 
             # Calculate balance based on account side
-            if account.side == 'D':
+            if side == 'D':
                 balance = total_debit - total_credit
             else:
                 balance = total_credit - total_debit
 
             result.append({
-                'code': account.code,
-                'name': account.name,
+                'code': code,
+                'name': name,
                 'debit': total_debit,
                 'credit': total_credit,
                 'balance': balance
@@ -370,14 +671,20 @@ class ReportService:
     @staticmethod
     def get_income_statement():
         """Generate income statement"""
-        all_entries = JournalEntry.query.all()
+        credit_balance = JournalEntry.credit - JournalEntry.debit
+        debit_balance = JournalEntry.debit - JournalEntry.credit
+
+        def bucket(prefix, balance):
+            return func.coalesce(func.sum(case((JournalEntry.acc.like(f'{prefix}%'), balance), else_=0)), 0)
 
-        revenue = sum(e.credit - e.debit for e in all_entries if e.acc.startswith('4-01-'))
-        returns = sum(e.debit - e.credit for e in all_entries if e.acc.startswith('4-02-'))
-        cogs = sum(e.debit - e.credit for e in all_entries if e.acc.startswith('5-'))
-        opex = sum(e.debit - e.credit for e in all_entries if e.acc.startswith('6-'))
-        other_income = sum(e.credit - e.debit for e in all_entries if e.acc.startswith('7-01-'))
-        other_expense = sum(e.debit - e.credit for e in all_entries if e.acc.startswith('7-02-'))
+        revenue, returns, cogs, opex, other_income, other_expense = db.session.query(
+            bucket('4-01-', credit_balance),
+            bucket('4-02-', debit_balance),
+            bucket('5-', debit_balance),
+            bucket('6-', debit_balance),
+            bucket('7-01-', credit_balance),
+            bucket('7-02-', debit_balance)
+        ).one()
 
         net_revenue = revenue - returns
         gross_profit = net_revenue - cogs
@@ -400,27 +707,22 @@ class ReportService:
     @staticmethod
     def get_balance_sheet():
         """Generate balance sheet"""
-        accounts = ChartOfAccount.query.all()
-        all_entries = JournalEntry.query.all()
+        totals = ReportService.get_account_totals()
+        sections = {'assets': 0, 'liabilities': 0, 'equity': 0}
 
-        assets = 0
-        liabilities = 0
-        equity = 0
+        for code, _, side, bucket in ReportService.get_chart():
+            if bucket is None:
+                continue
+            total_debit, total_credit = totals.get(code, (0, 0))
 
-        for account in accounts:
-            entries = [e for e in all_entries if e.acc == account.code]
-
-            if account.side == 'D':
-                balance = sum(e.debit - e.credit for e in entries)
+            if side == 'D':
+                sections[bucket] += total_debit - total_credit
             else:
-                balance = sum(e.credit - e.debit for e in entries)
-
-            if account.code.startswith('1-'):
-                assets += balance
-            elif account.code.startswith('2-'):
-                liabilities += balance
-            elif account.code.startswith('3-'):
-                equity += balance
+                sections[bucket] += total_credit - total_debit
+
+        assets = sections['assets']
+        liabilities = sections['liabilities']
+        equity = sections['equity']
 
         # Add net profit to equity
         is_data = ReportService.get_income_statement()
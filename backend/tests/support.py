@@ -0,0 +1,17 @@
+"""
+Shared test setup: a throwaway SQLite database and no Redis
+
+Import before app, models or services; the database URL is read when app is imported.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP_DIR, 'accounting.db')
+os.environ.pop('REDIS_URL', None)
+sys.path.insert(0, BACKEND_DIR)
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
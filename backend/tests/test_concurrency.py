@@ -0,0 +1,100 @@
+"""
+Concurrent voucher posting against a throwaway SQLite database
+
+Run from the backend directory: python -m unittest discover tests
+"""
+import contextlib
+import io
+import threading
+import unittest
+
+import support  # noqa: F401  (selects the throwaway database; must precede app)
+from app import app, db
+from models import Document, Item, StockBatch
+from seed_data import seed_database
+from services import AccountingService
+
+THREADS = 8
+SALES_PER_THREAD = 10
+
+
+class ConcurrentPostingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            seed_database()
+        with app.app_context():
+            cls.sku = Item.query.first().sku
+
+    def setUp(self):
+        self.client = app.test_client()
+        with app.app_context():
+            db.session.query(StockBatch).filter_by(sku=self.sku).delete()
+            db.session.commit()
+
+    def purchase(self, qty):
+        return self.client.post('/api/vouchers/purchase', json={
+            'date': '2024-01-01', 'branch': '', 'cc': '', 'sku': self.sku,
+            'qty': qty, 'price': 5, 'paymentType': 'نقدي'
+        }).json
+
+    def sale(self, client, qty):
+        return client.post('/api/vouchers/sale', json={
+            'date': '2024-01-02', 'branch': '', 'cc': '', 'sku': self.sku,
+            'qty': qty, 'price': 9, 'cashOrAR': 'نقدي'
+        }).json
+
+    def test_concurrent_sales_consume_fifo_exactly(self):
+        for _ in range(3):
+            self.assertTrue(self.purchase(100)['success'])
+
+        results = []
+
+        def worker():
+            client = app.test_client()
+            for _ in range(SALES_PER_THREAD):
+                results.append(self.sale(client, 3))
+
+        threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        errors = [r['error'] for r in results if not r['success']]
+        self.assertEqual(errors, [])
+        doc_nos = [r['doc_no'] for r in results]
+        self.assertEqual(len(set(doc_nos)), THREADS * SALES_PER_THREAD)
+
+        with app.app_context():
+            left = sum(b.qty for b in StockBatch.query.filter_by(sku=self.sku))
+            self.assertEqual(left, 300 - 3 * THREADS * SALES_PER_THREAD)
+            self.assertEqual(Document.query.filter(Document.no.in_(doc_nos)).count(), len(doc_nos))
+
+    def test_reset_keeps_numbers_unique_across_workers(self):
+        self.assertTrue(self.purchase(100)['success'])
+        first = self.sale(self.client, 1)
+        self.assertTrue(first['success'])
+
+        # Another worker still holding the block reserved before the reset
+        held = dict(AccountingService._seq_cache)
+        self.assertTrue(self.client.post('/api/reset').json['success'])
+        self.assertTrue(self.purchase(100)['success'])
+
+        # A worker starting after the reset reserves a fresh block from the database
+        AccountingService._seq_cache.clear()
+        fresh_worker = self.sale(self.client, 1)
+        AccountingService._seq_cache.update(held)
+        old_worker = self.sale(self.client, 1)
+
+        self.assertTrue(fresh_worker['success'], fresh_worker.get('error'))
+        self.assertTrue(old_worker['success'], old_worker.get('error'))
+        self.assertEqual(len({first['doc_no'], fresh_worker['doc_no'], old_worker['doc_no']}), 3)
+        # The fresh block starts past the held one, so the two workers can never collide
+        prefix, number = fresh_worker['doc_no'].split('-')
+        self.assertGreaterEqual(int(number), held[prefix][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+FIFO consumption: costing and how much of the SKU's stock a sale reads
+
+Run from the backend directory: python -m unittest discover tests
+"""
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import support  # noqa: F401  (selects the throwaway database; must precede app)
+from app import app, db
+from models import Item, StockBatch
+from services import AccountingService
+from sqlalchemy import insert
+
+SKU = 'TEST-FIFO'
+
+
+class FifoConsumeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with app.app_context():
+            db.create_all()
+            if db.session.get(Item, SKU) is None:
+                db.session.add(Item(sku=SKU, name='FIFO test item', uom='حبة', cat4='', cat5=''))
+                db.session.commit()
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.session.query(StockBatch).filter_by(sku=SKU).delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.ctx.pop()
+
+    def add_batches(self, count, qty=5, unit_cost=2):
+        start = datetime(2024, 1, 1)
+        db.session.execute(insert(StockBatch), [
+            {'sku': SKU, 'qty': qty, 'unit_cost': unit_cost, 'created_at': start + timedelta(seconds=i)}
+            for i in range(count)
+        ])
+        db.session.commit()
+
+    def remaining(self):
+        batches = StockBatch.query.filter_by(sku=SKU).order_by(StockBatch.created_at, StockBatch.id)
+        return [(float(b.qty), float(b.unit_cost)) for b in batches]
+
+    def vm_steps(self, fn, *args):
+        """SQLite VM steps (in units of 100) spent by fn(*args)"""
+        steps = [0]
+
+        def count():
+            steps[0] += 1
+            return 0
+
+        raw = db.session.connection().connection.dbapi_connection
+        raw.set_progress_handler(count, 100)
+        try:
+            fn(*args)
+        finally:
+            raw.set_progress_handler(None, 0)
+        db.session.rollback()
+        return steps[0]
+
+    def test_consumes_oldest_batches_first(self):
+        for unit_cost in (2, 3, 4):
+            AccountingService.fifo_add(SKU, 5, unit_cost)
+            db.session.flush()
+        db.session.commit()
+
+        cost = AccountingService.fifo_consume(SKU, 12)
+
+        self.assertEqual(cost, Decimal('33.0000'))
+        self.assertEqual(self.remaining(), [(3.0, 4.0)])
+
+    def test_shortfall_raises(self):
+        self.add_batches(2)
+        with self.assertRaises(ValueError):
+            AccountingService.fifo_consume(SKU, 11)
+
+    def test_work_does_not_grow_with_untouched_batches(self):
+        self.add_batches(10)
+        few = self.vm_steps(AccountingService.fifo_consume, SKU, 1)
+        self.add_batches(20000)
+        many = self.vm_steps(AccountingService.fifo_consume, SKU, 1)
+
+        # A scan of every batch would cost hundreds of times more at 20,010 batches
+        self.assertLess(many, few * 2 + 10)
+
+    def test_sale_context_reads_only_the_batches_reached(self):
+        self.add_batches(10)
+        item, _, plan = AccountingService.prepare_sale_context(SKU, 7)
+        self.assertEqual(item.name, 'FIFO test item')
+        self.assertEqual((plan.cost, plan.consumed), (14, 1))
+
+        few = self.vm_steps(AccountingService.prepare_sale_context, SKU, 1)
+        self.add_batches(20000)
+        many = self.vm_steps(AccountingService.prepare_sale_context, SKU, 1)
+        self.assertLess(many, few * 2 + 10)
+
+
+if __name__ == '__main__':
+    unittest.main()